@@ -1,7 +1,26 @@
-from functools import wraps
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import cache, wraps
 from math import ceil
+import asyncio
+import cProfile
+import csv
 import datetime
+import gzip
+import hashlib
+import io
+import json
+import math
+import mimetypes
 import os
+import pstats
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
 
 from flask import (
     Flask,
@@ -12,16 +31,44 @@ from flask import (
     url_for,
     abort,
     jsonify,
+    send_file,
+    send_from_directory,
+    g,
+    session,
+    has_request_context,
+    Response,
+    stream_with_context,
 )
+from flask_compress import Compress
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_migrate import Migrate, migrate
 from flask_login import UserMixin, login_user, LoginManager, current_user, logout_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from markupsafe import escape
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+import brotli
+import click
+import httpx
+import numpy as np
+from PIL import Image, ImageOps
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
 import requests
-from sqlalchemy import inspect
-from sqlalchemy.orm import relationship
+from scipy import sparse
+from sqlalchemy import inspect, Engine, UpdateBase
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import contains_eager, relationship
 from sqlalchemy.event import listens_for
-
+from sqlalchemy.pool import QueuePool
 
 # API key and secret key
 API_KEY = os.environ.get("API_KEY")
@@ -31,22 +78,280 @@ API_HEADERS = {
     "Authorization": f"Bearer {API_KEY}",
 }
 DB_URL = os.environ.get("DB_URL")
+# Comma separated URLs of read replicas of DB_URL (optional)
+REPLICA_DB_URLS = [
+    url.strip()
+    for url in os.environ.get("REPLICA_DB_URLS", "").split(",")
+    if url.strip()
+]
+# Seconds to keep reading from the primary after a user wrote something
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", 10))
+
+# Connection pool settings per worker process (not used for SQLite)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+# Max milliseconds per statement in web requests (PostgreSQL only, 0 disables)
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 5000))
+STATEMENT_TIMEOUT_EXEMPT_ENDPOINTS = ("export_table",)
 
 # TMDB API URLs
 URL_MOVIE_GENERS = "https://api.themoviedb.org/3/genre/movie/list?language=en"
 URL_TV_GENERS = "https://api.themoviedb.org/3/genre/tv/list?language=en"
+URL_SEARCH = "https://api.themoviedb.org/3/search/{movie_or_tv}"
+URL_DETAILS = "https://api.themoviedb.org/3/{movie_or_tv}/{title_id}"
+URL_POSTER = "https://www.themoviedb.org/t/p/w600_and_h900_bestv2{poster_path}"
+
+# TMDB search settings (result pages per type and concurrent requests)
+TMDB_SEARCH_PAGES = int(os.environ.get("TMDB_SEARCH_PAGES", 3))
+TMDB_CONCURRENCY = int(os.environ.get("TMDB_CONCURRENCY", 5))
+TMDB_TIMEOUT = 10
+
+# Metadata refresh settings (global TMDB budget in requests per second)
+REFRESH_BATCH_SIZE = 100
+REFRESH_RATE_LIMIT = float(os.environ.get("REFRESH_RATE_LIMIT", 20))
 
 # Set titles per page
 TITLES_PER_PAGE = 20
 
+# Set reviews per page on the user profile pages
+REVIEWS_PER_PAGE = 20
+
+# Response compression settings (dynamic HTML/JSON responses)
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 500))
+COMPRESS_MIMETYPES = [
+    "text/html",
+    "application/json",
+    "text/css",
+    "text/javascript",
+    "application/javascript",
+]
+
+# Static asset build settings (fingerprinted and precompressed files)
+STATIC_BUILD_DIRS = ("css", "js", "images")
+STATIC_PRECOMPRESS_EXTENSIONS = (".css", ".js", ".svg", ".ico")
+STATIC_MAX_AGE = 60 * 60 * 24 * 365
+
+# Poster thumbnail cache settings (variant name -> width, height)
+POSTER_SIZES = {"small": (100, 150), "card": (300, 450), "large": (600, 900)}
+POSTER_CACHE_MAX_BYTES = int(
+    os.environ.get("POSTER_CACHE_MAX_BYTES", 200 * 1024 * 1024)
+)
+POSTER_JPEG_QUALITY = 85
+
+# Rate limiting settings (tokens per second and bucket size per client)
+SEARCH_RATE_LIMIT = float(os.environ.get("SEARCH_RATE_LIMIT", 5))
+SEARCH_RATE_BURST = int(os.environ.get("SEARCH_RATE_BURST", 20))
+SELECT_RATE_LIMIT = float(os.environ.get("SELECT_RATE_LIMIT", 0.5))
+SELECT_RATE_BURST = int(os.environ.get("SELECT_RATE_BURST", 5))
+# Path of a SQLite file shared by all workers, in-process buckets if unset
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE")
+# Number of reverse proxies in front of the app (for the client IP)
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 0))
+
+# Trending settings (activity scores halve every TRENDING_HALF_LIFE_HOURS)
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get("TRENDING_HALF_LIFE_HOURS", 72))
+TRENDING_DECAY_RATE = math.log(2) / (TRENDING_HALF_LIFE_HOURS * 60 * 60)
+TRENDING_EPOCH = datetime.datetime(2024, 1, 1)
+TRENDING_MIN_SCORE = 0.25
+TRENDING_NEW_REVIEW_WEIGHT = 1.0
+TRENDING_UPDATED_REVIEW_WEIGHT = 0.5
+
+# Bulk export settings
+EXPORT_TABLES = ("titles", "reviews", "ratings")
+EXPORT_FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# "More like this" settings (similarity weights must sum to 1)
+SIMILAR_TOP_K = 10
+SIMILAR_GENRE_WEIGHT = 0.6
+SIMILAR_CO_REVIEW_WEIGHT = 0.3
+SIMILAR_RATING_WEIGHT = 0.1
+SIMILAR_BLOCK_SIZE = 512
+
+# Password hashing settings (hashes run in a process pool)
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256")
+PASSWORD_SALT_LENGTH = 16
+HASH_POOL_WORKERS = int(os.environ.get("HASH_POOL_WORKERS", 1))
+# Max hashes queued or running across all worker processes before rejecting logins
+HASH_QUEUE_LIMIT = int(os.environ.get("HASH_QUEUE_LIMIT", 8))
+HASH_TIMEOUT = 10
+
+# Request profiling settings (fraction of requests to profile, 0 disables)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_HEADER = "X-Profile"
+PROFILE_KEEP = 20
+
+# Pre-rendered page settings (catalog pages served as files to anonymous users)
+PRERENDER_WORKERS = int(os.environ.get("PRERENDER_WORKERS", os.cpu_count() or 1))
+PRERENDER_CHUNK_SIZE = 50
+PRERENDER_ENDPOINTS = ("movies_tv_pages", "get_title", "sitemap")
+PRERENDER_ENVIRON_KEY = "app.prerendering"
+
+# Load shedding settings (0 disables the check)
+MAX_INFLIGHT_REQUESTS = int(os.environ.get("MAX_INFLIGHT_REQUESTS", 0))
+MAX_QUEUE_WAIT_MS = int(os.environ.get("MAX_QUEUE_WAIT_MS", 0))
+SHEDDING_EXEMPT_ENDPOINTS = ("static", "static_dist", "poster", "metrics", "healthz")
+
+# Prometheus metrics
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_seconds",
+    "Time spent hashing or verifying a password, including queueing",
+    ["operation"],
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "password_hash_rejected_total",
+    "Password hash jobs rejected because the hashing pool was saturated",
+    ["operation"],
+)
+
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting for a database connection from the pool",
+    ["database"],
+)
+DB_POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total",
+    "Pool checkouts that gave up after DB_POOL_TIMEOUT seconds",
+    ["database"],
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Database connections currently checked out of the pool",
+    ["database"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_SATURATION = Gauge(
+    "db_pool_saturation",
+    "Checked out connections as a fraction of pool_size + max_overflow",
+    ["database"],
+    multiprocess_mode="livemax",
+)
+
+
+# Connection pool that records checkout wait time and saturation
+class MonitoredQueuePool(QueuePool):
+    def _do_get(self):
+        database = self.logging_name or "primary"
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.labels(database).inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.labels(database).observe(
+                time.perf_counter() - started
+            )
+            self.record_usage()
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self.record_usage()
+
+    def record_usage(self):
+        database = self.logging_name or "primary"
+        checked_out = self.checkedout()
+        DB_POOL_CHECKED_OUT.labels(database).set(checked_out)
+        # A negative max_overflow or a pool_size of 0 means no limit
+        if self._max_overflow < 0 or self.size() == 0:
+            saturation = 0
+        else:
+            saturation = checked_out / max(1, self.size() + self._max_overflow)
+        DB_POOL_SATURATION.labels(database).set(saturation)
+
+
 # Flask app setup
 app = Flask(__name__)
 app.config["SECRET_KEY"] = SECRET_KEY
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+
+# Session that sends read-only requests to a replica and writes to the primary
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # Use a replica only for read-only requests that have not written anything
+        if (
+            bind is None
+            and REPLICA_BIND_KEYS
+            and self.info.get("read_only")
+            and not self.info.get("wrote")
+            and not self._flushing
+            and not isinstance(clause, UpdateBase)
+        ):
+            # Stick to one replica for the whole request
+            replica_key = self.info.setdefault(
+                "replica_key", random.choice(REPLICA_BIND_KEYS)
+            )
+            return self._db.engines[replica_key]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
 
 app.config["SQLALCHEMY_DATABASE_URI"] = DB_URL
-db = SQLAlchemy(app)
+REPLICA_BIND_KEYS = [f"replica_{index}" for index in range(len(REPLICA_DB_URLS))]
+app.config["SQLALCHEMY_BINDS"] = {
+    bind_key: {"url": url, "pool_logging_name": bind_key}
+    for bind_key, url in zip(REPLICA_BIND_KEYS, REPLICA_DB_URLS)
+}
+# Size the connection pools of server databases (SQLite keeps its defaults)
+if not (DB_URL or "").startswith("sqlite"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "poolclass": MonitoredQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        # Replace connections that died, e.g. after a database restart
+        "pool_pre_ping": True,
+    }
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
 migrate = Migrate(app, db)
 
+# Compress dynamic responses (static files are precompressed by build-static)
+app.config["COMPRESS_MIMETYPES"] = COMPRESS_MIMETYPES
+app.config["COMPRESS_MIN_SIZE"] = COMPRESS_MIN_SIZE
+app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+app.config["COMPRESS_STREAMS"] = False
+compress = Compress(app)
+
+# Load the manifest of fingerprinted static files, if build-static was run
+STATIC_DIST_DIR = os.path.join(app.static_folder, "dist")
+STATIC_MANIFEST_PATH = os.path.join(STATIC_DIST_DIR, "manifest.json")
+static_manifest = {}
+if os.path.isfile(STATIC_MANIFEST_PATH):
+    with open(STATIC_MANIFEST_PATH) as manifest_file:
+        static_manifest = json.load(manifest_file)
+
+# Directory for the saved request profiles
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(
+    app.instance_path, "profiles"
+)
+
+# Directory for the pre-rendered catalog pages and their manifest
+PRERENDER_DIR = os.environ.get("PRERENDER_DIR") or os.path.join(
+    app.instance_path, "prerendered"
+)
+PRERENDER_MANIFEST_PATH = os.path.join(PRERENDER_DIR, "manifest.json")
+
+# SQLite file counting the password hashes running in all worker processes
+HASH_SLOTS_STORE = os.environ.get("HASH_SLOTS_STORE") or os.path.join(
+    app.instance_path, "hash_slots.db"
+)
+
+# File recording how far the metadata refresh job got
+REFRESH_CHECKPOINT_PATH = os.environ.get("REFRESH_CHECKPOINT_PATH") or os.path.join(
+    app.instance_path, "refresh_checkpoint.json"
+)
+
+# Directory for the locally cached, resized posters
+POSTER_CACHE_DIR = os.environ.get("POSTER_CACHE_DIR") or os.path.join(
+    app.instance_path, "poster_cache"
+)
+
 
 # User model with relationship to Reviews
 class Users(UserMixin, db.Model):
@@ -54,6 +359,8 @@ class Users(UserMixin, db.Model):
     email = db.Column(db.String(100), unique=True)
     password = db.Column(db.String(1000))
     name = db.Column(db.String(100))
+    # Number of reviews by the user, maintained in before_commit
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     review = relationship("Reviews", back_populates="author")
 
@@ -68,9 +375,27 @@ class Titles(db.Model):
     img_url = db.Column(db.String(200), unique=False, nullable=False)
     movie_or_tv = db.Column(db.String(20), unique=False, nullable=False)
     ratings = db.Column(db.Float(1), default=0.0)  # Average rating for the title
+    # Log of the time-decayed activity score, scaled to TRENDING_EPOCH
+    trending = db.Column(db.Float, nullable=True, index=True)
 
     review = relationship("Reviews", back_populates="title")
 
+    # Index for browsing titles by release year
+    __table_args__ = (
+        db.Index("ix_titles_movie_or_tv_release_date", movie_or_tv, release_date),
+    )
+
+    @property
+    def poster_hash(self):
+        # Short hash of the poster URL, so a changed poster gets a new cache key
+        return hashlib.sha1(self.img_url.encode()).hexdigest()[:10]
+
+    def poster_url(self, size):
+        # URL of the locally cached poster variant of the given size
+        return url_for(
+            "poster", title_id=self.id, poster_hash=self.poster_hash, size=size
+        )
+
     @property
     def average_rating(self):
         # Calculate the average rating for the title
@@ -91,27 +416,258 @@ class Reviews(db.Model):
     comment = db.Column(db.String(200), unique=False, nullable=False)
     date_posted = db.Column(db.DateTime, unique=False, nullable=False)
 
+    # Index for listing a user's reviews, newest first
+    __table_args__ = (
+        db.Index(
+            "ix_reviews_author_id_date_posted",
+            author_id,
+            date_posted.desc(),
+            id.desc(),
+        ),
+    )
+
+
+# Precomputed "more like this" titles, top-k per title ordered by rank
+class SimilarTitles(db.Model):
+    title_id = db.Column(db.Integer, db.ForeignKey("titles.id"), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    similar_id = db.Column(db.Integer, db.ForeignKey("titles.id"), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False)
+
+
+# Function to change the denormalized review count of a user in the database
+def update_review_count(session, user_id, change):
+    session.execute(
+        db.update(Users)
+        .where(Users.id == user_id)
+        .values(review_count=Users.review_count + change)
+    )
+
+
+# Function to get the file of a pre-rendered page, relative to PRERENDER_DIR
+def prerendered_filename(url_path):
+    filename = url_path.strip("/")
+    if not os.path.splitext(filename)[1]:
+        filename += ".html"
+    return filename
+
+
+# Function to remove a pre-rendered page and its variants, so it is rendered live
+def discard_prerendered(url_path):
+    file_path = os.path.join(PRERENDER_DIR, prerendered_filename(url_path))
+    for path in (file_path, f"{file_path}.gz", f"{file_path}.br"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Function to remove the pre-rendered page of a title
+def discard_prerendered_title(movie_or_tv, title_id):
+    discard_prerendered(f"/titles/{movie_or_tv}/{title_id}")
+
+
+# Function to remove the pre-rendered listing pages of a type and the sitemap,
+# which no longer match once titles of that type are added or deleted
+def discard_prerendered_listing(movie_or_tv):
+    movies_tv_shows = "movies" if movie_or_tv == "movie" else "tv_shows"
+    shutil.rmtree(os.path.join(PRERENDER_DIR, movies_tv_shows), ignore_errors=True)
+    discard_prerendered("/sitemap.xml")
+
+
+# Function to get the author id of a review, set either as author_id or author
+def review_author_id(review):
+    if review.author_id is not None:
+        return review.author_id
+    return review.author.id if review.author else None
+
+
+# Function to delete titles and their reviews with set-based statements
+def delete_titles_by_id(title_ids):
+    # Stop serving the pre-rendered pages of the deleted titles
+    deleted_titles = db.session.execute(
+        db.select(Titles.id, Titles.movie_or_tv).where(Titles.id.in_(title_ids))
+    ).all()
+    for title_id, movie_or_tv in deleted_titles:
+        discard_prerendered_title(movie_or_tv, title_id)
+    for movie_or_tv in {movie_or_tv for _, movie_or_tv in deleted_titles}:
+        discard_prerendered_listing(movie_or_tv)
+
+    # Reviews of the deleted titles, removed without loading them into the session
+    deleted_reviews = Reviews.title_id.in_(title_ids)
+
+    # Subtract the deleted reviews from the review counts of their authors
+    db.session.execute(
+        db.update(Users)
+        .where(Users.id.in_(db.select(Reviews.author_id).where(deleted_reviews)))
+        .values(
+            review_count=Users.review_count
+            - db.select(db.func.count(Reviews.id))
+            .where(Reviews.author_id == Users.id, deleted_reviews)
+            .scalar_subquery()
+        ),
+        execution_options={"synchronize_session": False},
+    )
+
+    # Remove the titles from the counts of their release years
+    release_year = db.extract("year", Titles.release_date)
+    year_counts = db.session.execute(
+        db.select(release_year, Titles.movie_or_tv, db.func.count(Titles.id))
+        .where(Titles.id.in_(title_ids))
+        .group_by(release_year, Titles.movie_or_tv)
+    ).all()
+    for year, movie_or_tv, count in year_counts:
+        update_year_count(db.session, int(year), movie_or_tv, -count)
+
+    # Remove the titles from the precomputed similar titles
+    db.session.execute(
+        db.delete(SimilarTitles).where(
+            SimilarTitles.title_id.in_(title_ids)
+            | SimilarTitles.similar_id.in_(title_ids)
+        )
+    )
+
+    # Delete the reviews, then the titles, skipping the average rating updates
+    db.session.execute(
+        db.delete(Reviews).where(deleted_reviews),
+        execution_options={"synchronize_session": False},
+    )
+    result = db.session.execute(db.delete(Titles).where(Titles.id.in_(title_ids)))
+
+    # Return the number of deleted titles
+    return result.rowcount
+
+
+# Precomputed number of titles per release year and type
+class YearCounts(db.Model):
+    year = db.Column(db.Integer, primary_key=True)
+    movie_or_tv = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Function to change the number of titles of a release year and type
+def update_year_count(session, year, movie_or_tv, change):
+    result = session.execute(
+        db.update(YearCounts)
+        .where(YearCounts.year == year, YearCounts.movie_or_tv == movie_or_tv)
+        .values(count=YearCounts.count + change)
+    )
+    # Add the row on the first title of that year and type
+    if not result.rowcount and change > 0:
+        session.execute(
+            db.insert(YearCounts).values(
+                year=year, movie_or_tv=movie_or_tv, count=change
+            )
+        )
+
+
+# Function to get the log trending score of an activity, scaled to TRENDING_EPOCH
+def trending_log_score(weight, when):
+    # Scaling every score to the same epoch keeps the order correct as time
+    # passes, since all scores decay by the same factor
+    seconds = (when - TRENDING_EPOCH).total_seconds()
+    return math.log(weight) + TRENDING_DECAY_RATE * seconds
+
+
+# Function to add an activity to the trending score of a title in O(1)
+def add_trending_activity(title, weight, when):
+    activity = trending_log_score(weight, when)
+    if title.trending is None:
+        title.trending = activity
+    else:
+        # Add the scores in log space, which never overflows
+        title.trending = float(np.logaddexp(title.trending, activity))
+
 
 # Listen for the before_commit event to update average ratings
 @listens_for(db.session, "before_commit")
 def before_commit(session):
     for obj in session.new:
+        # Check if the object being committed is a Title
+        if isinstance(obj, Titles):
+            # Count the title in its release year
+            update_year_count(session, obj.release_date.year, obj.movie_or_tv, 1)
+            # The pre-rendered listing pages do not show the new title
+            discard_prerendered_listing(obj.movie_or_tv)
+
+        # Check if the object being committed is a Review
+        if isinstance(obj, Reviews):
+            # Increment the review count of the author, set by id or object
+            author_id = review_author_id(obj)
+            if author_id is not None:
+                update_review_count(session, author_id, 1)
+            elif obj.author:
+                # The author is new too, so count the review on the pending user
+                obj.author.review_count = (obj.author.review_count or 0) + 1
+
         # Check if the object being committed is a Review and has a title
         if isinstance(obj, Reviews) and obj.title:
             # Update the average rating for the corresponding Title
             obj.title.ratings = obj.title.average_rating
+            # The pre-rendered title page no longer shows every review
+            discard_prerendered_title(obj.title.movie_or_tv, obj.title.id)
+            # Count the new review as trending activity
+            add_trending_activity(
+                obj.title, TRENDING_NEW_REVIEW_WEIGHT, obj.date_posted
+            )
 
     for obj in session.deleted:
+        # Check if the object being committed is a Title
+        if isinstance(obj, Titles):
+            # Remove the title from the count of its release year
+            update_year_count(session, obj.release_date.year, obj.movie_or_tv, -1)
+            # Stop serving the pre-rendered pages that show the title
+            discard_prerendered_title(obj.movie_or_tv, obj.id)
+            discard_prerendered_listing(obj.movie_or_tv)
+
+        # Check if the object being committed is a Review and has an author
+        if isinstance(obj, Reviews) and review_author_id(obj) is not None:
+            # Decrement the review count of the author
+            update_review_count(session, review_author_id(obj), -1)
+
         # Check if the object being committed is a Review and has a title
         if isinstance(obj, Reviews) and obj.title:
             # Update the average rating for the corresponding Title
             obj.title.ratings = obj.title.average_rating
+            # The pre-rendered title page still shows the deleted review
+            discard_prerendered_title(obj.title.movie_or_tv, obj.title.id)
 
     for obj in session.dirty:
         # Check if the object being committed is a Review and has a title
         if isinstance(obj, Reviews) and obj.title:
             # Update the average rating for the corresponding Title
             obj.title.ratings = obj.title.average_rating
+            # The pre-rendered title page shows the old version of the review
+            discard_prerendered_title(obj.title.movie_or_tv, obj.title.id)
+            # Count the updated review as trending activity
+            add_trending_activity(
+                obj.title, TRENDING_UPDATED_REVIEW_WEIGHT, obj.date_posted
+            )
+
+
+# Limit how long a single statement of a web request may run
+@listens_for(Engine, "begin")
+def set_statement_timeout(connection):
+    if (
+        DB_STATEMENT_TIMEOUT_MS
+        and connection.dialect.name == "postgresql"
+        and has_request_context()
+        and request.endpoint not in STATEMENT_TIMEOUT_EXEMPT_ENDPOINTS
+    ):
+        connection.exec_driver_sql(
+            f"SET LOCAL statement_timeout = {DB_STATEMENT_TIMEOUT_MS}"
+        )
+
+
+# Mark the session as written to, so reads stay on the primary
+@listens_for(db.session, "after_flush")
+def pin_to_primary(db_session, flush_context):
+    db_session.info["wrote"] = True
+
+    # Let the user read their own writes on the next requests too
+    if REPLICA_BIND_KEYS and has_request_context():
+        session["primary_until"] = time.time() + REPLICA_PIN_SECONDS
 
 
 # Check if tables exist before creating them
@@ -148,53 +704,967 @@ for genre in tv_genres:
     genres_dict[genre["id"]] = genre["name"]
 
 
+# Function to extract the relevant information of a TMDB search result
+def parse_tmdb_title(movie_or_tv, title):
+    # Determine the key names based on the movie_or_tv parameter
+    if movie_or_tv == "movie":
+        release_date_text = "release_date"
+        title_text = "title"
+    elif movie_or_tv == "tv":
+        release_date_text = "first_air_date"
+        title_text = "name"
+
+    # Create a dictionary with relevant title information
+    return {
+        "id": title["id"],
+        "title": title[title_text],
+        "release_date": title[release_date_text],
+        "overview": title["overview"],
+        "img_url": URL_POSTER.format(poster_path=title["poster_path"]),
+        "genre_ids": title["genre_ids"],
+        "movie_or_tv": movie_or_tv,
+    }
+
+
+# Coroutine to fetch one page of TMDB search results
+async def fetch_search_page(client, semaphore, movie_or_tv, title, page):
+    # Limit the number of requests running against the API at once
+    async with semaphore:
+        response = await client.get(
+            URL_SEARCH.format(movie_or_tv=movie_or_tv),
+            params={
+                "query": title,
+                "include_adult": "false",
+                "language": "en-US",
+                "page": page,
+            },
+        )
+
+    # Raise an exception for HTTP errors
+    response.raise_for_status()
+    return [
+        parse_tmdb_title(movie_or_tv, result) for result in response.json()["results"]
+    ]
+
+
+# Coroutine to fetch several pages of movie and/or TV results concurrently
+async def search_tmdb(movie_or_tv_list, title, pages):
+    semaphore = asyncio.Semaphore(TMDB_CONCURRENCY)
+    async with httpx.AsyncClient(headers=API_HEADERS, timeout=TMDB_TIMEOUT) as client:
+        pages_results = await asyncio.gather(
+            *(
+                fetch_search_page(client, semaphore, movie_or_tv, title, page)
+                for movie_or_tv in movie_or_tv_list
+                for page in range(1, pages + 1)
+            )
+        )
+
+    # Merge the pages in order, dropping titles that appear more than once
+    titles_list = []
+    seen_titles = set()
+    for page_results in pages_results:
+        for title_info in page_results:
+            key = (title_info["movie_or_tv"], title_info["id"])
+            if key not in seen_titles:
+                seen_titles.add(key)
+                titles_list.append(title_info)
+    return titles_list
+
+
 # Function to fetch titles from TMDB API based on search query
 def fetch_titles_from_api(movie_or_tv, title):
-    # Construct the API URL for searching titles based on the provided parameters
-    url = f"https://api.themoviedb.org/3/search/{movie_or_tv}?query={title}&include_adult=false&language=en-US&page=1"
+    # Search both movies and TV shows when "all" is selected
+    movie_or_tv_list = ("movie", "tv") if movie_or_tv == "all" else (movie_or_tv,)
 
     try:
-        # Make a GET request to the TMDB API with the specified headers
-        response = requests.get(url, headers=API_HEADERS)
+        # Run the concurrent search, so the request waits for one round-trip
+        return asyncio.run(search_tmdb(movie_or_tv_list, title, TMDB_SEARCH_PAGES))
 
-        # Raise an exception for HTTP errors
-        response.raise_for_status()
+    # Handle exceptions related to the API request
+    except httpx.HTTPError as e:
+        print(f"Error during API request: {e}")
+        # Abort the request and return a 500 Internal Server Error status
+        abort(500)
 
-        # Parse the JSON response and extract the results
-        response = response.json()["results"]
-        # Initialize an empty list to store the extracted title information
-        titles_list = []
-
-        # Loop through each title in the API response
-        for title in response:
-            # Determine the key names based on the movie_or_tv parameter
-            if movie_or_tv == "movie":
-                release_date_text = "release_date"
-                title_text = "title"
-            elif movie_or_tv == "tv":
-                release_date_text = "first_air_date"
-                title_text = "name"
-
-            # Create a dictionary with relevant title information and append it to the list
-            titles_list.append(
-                {
-                    "id": title["id"],
-                    "title": title[title_text],
-                    "release_date": title[release_date_text],
-                    "overview": title["overview"],
-                    "img_url": f"https://www.themoviedb.org/t/p/w600_and_h900_bestv2{title['poster_path']}",
-                    "genre_ids": title["genre_ids"],
-                }
-            )
-            # Return the list of titles
-        return titles_list
+
+# Function to fetch one title from the TMDB API by its id
+def fetch_title_from_api(movie_or_tv, title_id):
+    try:
+        response = httpx.get(
+            URL_DETAILS.format(movie_or_tv=movie_or_tv, title_id=title_id),
+            headers=API_HEADERS,
+            params={"language": "en-US"},
+            timeout=TMDB_TIMEOUT,
+        )
+        # Return None for ids TMDB does not know
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
 
     # Handle exceptions related to the API request
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error during API request: {e}")
         # Abort the request and return a 500 Internal Server Error status
         abort(500)
 
+    # The details list the genres as objects instead of ids
+    details = response.json()
+    details["genre_ids"] = [genre["id"] for genre in details["genres"]]
+    return parse_tmdb_title(movie_or_tv, details)
+
+
+# Hashing slots held in a SQLite file, so the limit covers every worker process
+class SQLiteHashSlots:
+    def __init__(self, path, limit):
+        self.path = path
+        self.limit = limit
+        self.local = threading.local()
+
+    def connection(self):
+        # Open one connection per thread, creating the table on first use
+        if not hasattr(self.local, "connection"):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS hash_slots "
+                "(id INTEGER PRIMARY KEY, started REAL)"
+            )
+            self.local.connection = connection
+        return self.local.connection
+
+    def acquire(self):
+        # Take a free slot and return its id, or None when all slots are taken
+        try:
+            connection = self.connection()
+            now = time.time()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Free the slots of jobs whose worker died without releasing them
+                connection.execute(
+                    "DELETE FROM hash_slots WHERE started < ?",
+                    (now - 2 * HASH_TIMEOUT,),
+                )
+                (taken,) = connection.execute(
+                    "SELECT COUNT(*) FROM hash_slots"
+                ).fetchone()
+                if taken >= self.limit:
+                    return None
+                return connection.execute(
+                    "INSERT INTO hash_slots (started) VALUES (?)", (now,)
+                ).lastrowid
+            finally:
+                connection.execute("COMMIT")
+        except sqlite3.OperationalError as e:
+            # A store too busy to answer in time counts as saturated
+            print(f"Error while taking a hashing slot: {e}")
+            return None
+
+    def release(self, slot_id):
+        try:
+            self.connection().execute("DELETE FROM hash_slots WHERE id = ?", (slot_id,))
+        except sqlite3.OperationalError as e:
+            # The slot expires on its own after 2 * HASH_TIMEOUT
+            print(f"Error while releasing a hashing slot: {e}")
+
+
+# Process pool for password hashing, created lazily in each worker process
+hash_pool = None
+hash_pool_lock = threading.Lock()
+hash_slots = SQLiteHashSlots(HASH_SLOTS_STORE, HASH_QUEUE_LIMIT)
+
+
+# Function to get the password hashing pool
+def get_hash_pool():
+    global hash_pool
+    with hash_pool_lock:
+        if hash_pool is None:
+            hash_pool = ProcessPoolExecutor(max_workers=HASH_POOL_WORKERS)
+        return hash_pool
+
+
+# Function to run a hashing job in the pool, rejecting it fast when saturated
+def run_hash_job(operation, function, *args, **kwargs):
+    global hash_pool
+    # Reject the request with 503 instead of queueing behind other hashes
+    slot_id = hash_slots.acquire()
+    if slot_id is None:
+        PASSWORD_HASH_REJECTED.labels(operation).inc()
+        abort(503, retry_after=1)
+
+    started = time.perf_counter()
+    future = None
+    try:
+        future = get_hash_pool().submit(function, *args, **kwargs)
+        # Free the slot when the job finishes, not when this request stops
+        # waiting, so timed out jobs still count against HASH_QUEUE_LIMIT
+        future.add_done_callback(lambda _: hash_slots.release(slot_id))
+        return future.result(timeout=HASH_TIMEOUT)
+    except (TimeoutError, BrokenProcessPool) as e:
+        print(f"Error while hashing password: {e!r}")
+        # Start a fresh pool on the next job if this one broke
+        if isinstance(e, BrokenProcessPool):
+            with hash_pool_lock:
+                hash_pool = None
+        abort(503, retry_after=1)
+    finally:
+        # The job never started, so no callback will free the slot
+        if future is None:
+            hash_slots.release(slot_id)
+        PASSWORD_HASH_SECONDS.labels(operation).observe(time.perf_counter() - started)
+
+
+# Function to hash a password with the configured method
+def hash_password(password):
+    return run_hash_job(
+        "hash",
+        generate_password_hash,
+        password,
+        method=PASSWORD_HASH_METHOD,
+        salt_length=PASSWORD_SALT_LENGTH,
+    )
+
+
+# Function to check a password against its stored hash
+def verify_password(password_hash, password):
+    return run_hash_job("verify", check_password_hash, password_hash, password)
+
+
+# Function to get the method prefix of new hashes, e.g. "pbkdf2:sha256:600000",
+# hashing once in the pool per worker process
+@cache
+def password_hash_prefix():
+    return hash_password("").split("$", 1)[0]
+
+
+# Function to check if a stored hash uses an outdated method or cost
+def password_needs_rehash(password_hash):
+    return password_hash.split("$", 1)[0] != password_hash_prefix()
+
+
+# Spaces out requests to stay within a global requests-per-second budget
+class AsyncRateLimiter:
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_time = 0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        # Reserve the next free time slot, then sleep until it comes
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Coroutine to fetch the current overview, poster and genres of a stored title
+async def fetch_title_details(client, semaphore, rate_limiter, title):
+    async with semaphore:
+        await rate_limiter.wait()
+        response = await client.get(
+            URL_DETAILS.format(movie_or_tv=title.movie_or_tv, title_id=title.id),
+            params={"language": "en-US"},
+        )
+
+    # Skip titles that were removed from TMDB
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    details = response.json()
+
+    # Keep the stored poster if TMDB no longer has one
+    return {
+        "overview": details["overview"],
+        "img_url": (
+            URL_POSTER.format(poster_path=details["poster_path"])
+            if details["poster_path"]
+            else title.img_url
+        ),
+        "genre_ids": [genre["id"] for genre in details["genres"]],
+    }
+
+
+# Function to read the id of the last refreshed title
+def read_refresh_checkpoint():
+    try:
+        with open(REFRESH_CHECKPOINT_PATH) as checkpoint_file:
+            return json.load(checkpoint_file)["last_id"]
+    except FileNotFoundError:
+        return 0
+
+
+# Function to save the id of the last refreshed title
+def write_refresh_checkpoint(last_id):
+    os.makedirs(os.path.dirname(REFRESH_CHECKPOINT_PATH), exist_ok=True)
+    temp_path = f"{REFRESH_CHECKPOINT_PATH}.tmp"
+    with open(temp_path, "w") as checkpoint_file:
+        json.dump({"last_id": last_id}, checkpoint_file)
+    os.replace(temp_path, REFRESH_CHECKPOINT_PATH)
+
+
+# Coroutine to refresh the stored titles from TMDB, batch by batch in id order
+async def refresh_titles_job(batch_size, concurrency, rate):
+    semaphore = asyncio.Semaphore(concurrency)
+    rate_limiter = AsyncRateLimiter(rate)
+    last_id = read_refresh_checkpoint()
+    refreshed_count = updated_count = failed_count = 0
+
+    async with httpx.AsyncClient(headers=API_HEADERS, timeout=TMDB_TIMEOUT) as client:
+        while True:
+            # Get the next batch of titles after the checkpoint
+            batch = db.session.execute(
+                db.select(
+                    Titles.id,
+                    Titles.movie_or_tv,
+                    Titles.overview,
+                    Titles.img_url,
+                    Titles.genre_ids,
+                )
+                .where(Titles.id > last_id)
+                .order_by(Titles.id)
+                .limit(batch_size)
+            ).all()
+            if not batch:
+                break
+
+            # Fetch the details of the whole batch concurrently
+            details_list = await asyncio.gather(
+                *(
+                    fetch_title_details(client, semaphore, rate_limiter, title)
+                    for title in batch
+                ),
+                return_exceptions=True,
+            )
+
+            # Collect only the columns that changed
+            changes = []
+            for title, details in zip(batch, details_list):
+                if isinstance(details, Exception):
+                    print(f"Error while refreshing title {title.id}: {details!r}")
+                    failed_count += 1
+                    continue
+                if details is None:
+                    continue
+                changed = {
+                    column: value
+                    for column, value in details.items()
+                    if getattr(title, column) != value
+                }
+                if changed:
+                    changes.append({"id": title.id, **changed})
+
+            # Write the changes with one bulk UPDATE, then save the checkpoint
+            if changes:
+                db.session.execute(db.update(Titles), changes)
+            db.session.commit()
+            last_id = batch[-1].id
+            write_refresh_checkpoint(last_id)
+            refreshed_count += len(batch)
+            updated_count += len(changes)
+
+    # Start from the first title on the next run
+    if os.path.exists(REFRESH_CHECKPOINT_PATH):
+        os.remove(REFRESH_CHECKPOINT_PATH)
+    return refreshed_count, updated_count, failed_count
+
+
+# CLI command for refreshing the stored titles' metadata from TMDB
+@app.cli.command("refresh-titles")
+@click.option("--batch-size", default=REFRESH_BATCH_SIZE, help="Titles per batch.")
+@click.option("--concurrency", default=TMDB_CONCURRENCY, help="Parallel requests.")
+@click.option("--rate", default=REFRESH_RATE_LIMIT, help="Max requests per second.")
+@click.option("--restart", is_flag=True, help="Ignore the saved checkpoint.")
+def refresh_titles(batch_size, concurrency, rate, restart):
+    """Refresh overviews, posters and genres of the stored titles."""
+    if restart and os.path.exists(REFRESH_CHECKPOINT_PATH):
+        os.remove(REFRESH_CHECKPOINT_PATH)
+
+    refreshed_count, updated_count, failed_count = asyncio.run(
+        refresh_titles_job(batch_size, concurrency, rate)
+    )
+    click.echo(
+        f"Refreshed {refreshed_count} titles: {updated_count} updated, "
+        f"{failed_count} failed"
+    )
+
+
+# Function to get the path of a cached poster variant
+def poster_cache_path(title_id, poster_hash, size):
+    return os.path.join(POSTER_CACHE_DIR, f"{title_id}-{poster_hash}-{size}.jpg")
+
+
+# Function to fetch a poster once, store all of its resized variants and
+# return their JPEG bytes by size
+def cache_poster_variants(title):
+    # Download the original poster from TMDB
+    response = requests.get(title.img_url, timeout=10)
+    response.raise_for_status()
+    image = Image.open(io.BytesIO(response.content)).convert("RGB")
+
+    os.makedirs(POSTER_CACHE_DIR, exist_ok=True)
+    variants = {}
+    for size, dimensions in POSTER_SIZES.items():
+        # Resize and crop the poster to the variant dimensions
+        variant = ImageOps.fit(image, dimensions, Image.LANCZOS)
+        buffer = io.BytesIO()
+        variant.save(buffer, "JPEG", quality=POSTER_JPEG_QUALITY, optimize=True)
+        variants[size] = buffer.getvalue()
+
+        # Write to a temporary file unique to this call, so threads caching the
+        # same poster never share one and readers never see partial files
+        path = poster_cache_path(title.id, title.poster_hash, size)
+        temp_fd, temp_path = tempfile.mkstemp(dir=POSTER_CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(temp_fd, "wb") as temp_file:
+                temp_file.write(variants[size])
+            os.replace(temp_path, path)
+        except OSError:
+            # Remove the temporary file if it could not be moved into place
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    # Keep the cache directory within its size budget
+    evict_poster_cache()
+    return variants
+
+
+# Function to evict the least recently used posters when the cache is too big
+def evict_poster_cache():
+    entries = []
+    for entry in os.scandir(POSTER_CACHE_DIR):
+        if entry.is_file() and entry.name.endswith(".jpg"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    if total_bytes <= POSTER_CACHE_MAX_BYTES:
+        return
+
+    # Remove the oldest files until the cache is back under 90% of the budget
+    for _, size, path in sorted(entries):
+        if total_bytes <= POSTER_CACHE_MAX_BYTES * 0.9:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+
+
+# Token buckets held in the memory of the current worker process
+class MemoryTokenBuckets:
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        # Take one token from the bucket and return the seconds to wait if empty
+        now = time.monotonic()
+        with self.lock:
+            if len(self.buckets) > self.MAX_BUCKETS:
+                # Drop the buckets that have been refilled completely
+                self.buckets = {
+                    bucket_key: (tokens, updated)
+                    for bucket_key, (tokens, updated) in self.buckets.items()
+                    if tokens + (now - updated) * rate < burst
+                }
+
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return 0
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+
+# Token buckets held in a SQLite file shared by all local worker processes
+class SQLiteTokenBuckets:
+    # Buckets idle this long have refilled completely and can be dropped
+    PRUNE_AFTER = 60 * 60
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        # Open one connection per thread, creating the table on first use
+        if not hasattr(self.local, "connection"):
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_buckets_updated ON buckets (updated)"
+            )
+            self.local.connection = connection
+            self.local.pruned = time.time()
+        return self.local.connection
+
+    def take(self, key, rate, burst):
+        # Take one token from the bucket and return the seconds to wait if empty
+        now = time.time()
+        try:
+            connection = self.connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Drop the buckets of clients that have been idle for a long time
+                if now - self.local.pruned > self.PRUNE_INTERVAL:
+                    connection.execute(
+                        "DELETE FROM buckets WHERE updated < ?",
+                        (now - self.PRUNE_AFTER,),
+                    )
+                    self.local.pruned = now
+
+                row = connection.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated = row if row else (burst, now)
+                tokens = min(burst, tokens + (now - updated) * rate)
+                retry_after = 0 if tokens >= 1 else (1 - tokens) / rate
+                if not retry_after:
+                    tokens -= 1
+                connection.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) "
+                    "VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+            finally:
+                connection.execute("COMMIT")
+        except sqlite3.OperationalError as e:
+            # Let the request through rather than failing it when the store is busy
+            print(f"Error while checking the rate limit: {e}")
+            return 0
+        return retry_after
+
+
+# Choose where the rate limiter keeps its state
+if RATE_LIMIT_STORE:
+    rate_limit_store = SQLiteTokenBuckets(RATE_LIMIT_STORE)
+else:
+    rate_limit_store = MemoryTokenBuckets()
+
+
+# Decorator for limiting how often each client can call a route
+def rate_limited(rate, burst):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if rate > 0:
+                # Key the bucket by the logged in user, or by the client IP
+                if current_user.is_authenticated:
+                    client = f"user:{current_user.id}"
+                else:
+                    client = f"ip:{request.remote_addr}"
+
+                # Reject the request with 429 Too Many Requests if the bucket is empty
+                retry_after = rate_limit_store.take(
+                    f"{f.__name__}:{client}", rate, burst
+                )
+                if retry_after:
+                    abort(429, retry_after=ceil(retry_after))
+
+            return f(*args, **kwargs)
+
+        return decorated_function
+
+    return decorator
+
+
+# Number of requests currently being handled by this worker process (only
+# more than one with threaded workers, so MAX_INFLIGHT_REQUESTS needs those)
+inflight_requests = 0
+inflight_lock = threading.Lock()
+
+
+# Function to get how long a request waited in the proxy queue, in milliseconds
+def request_queue_wait_ms():
+    # Proxies send e.g. "t=1700000000123" (ms), or in seconds / microseconds
+    header = request.headers.get("X-Request-Start", "")
+    try:
+        started = float(header.removeprefix("t="))
+    except ValueError:
+        return 0
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    return max(0, (time.time() - started) * 1000)
+
+
+# Shed load with a fast 503 instead of letting requests pile up
+@app.before_request
+def shed_load():
+    global inflight_requests
+    if request.endpoint in SHEDDING_EXEMPT_ENDPOINTS:
+        return
+
+    # Reject requests that already waited too long in the queue
+    if MAX_QUEUE_WAIT_MS and request_queue_wait_ms() > MAX_QUEUE_WAIT_MS:
+        abort(503, retry_after=1)
+
+    # Reject requests when this worker is already busy with too many requests
+    if MAX_INFLIGHT_REQUESTS:
+        with inflight_lock:
+            if inflight_requests >= MAX_INFLIGHT_REQUESTS:
+                abort(503, retry_after=1)
+            inflight_requests += 1
+        g.counted_inflight = True
+
+
+# Release the in-flight slot taken by shed_load
+@app.teardown_request
+def release_inflight(exception):
+    global inflight_requests
+    if g.pop("counted_inflight", False):
+        with inflight_lock:
+            inflight_requests -= 1
+
+
+# Function to build the query for one of the exported tables
+def export_query(table, since=None):
+    if table == "titles":
+        query = db.select(
+            Titles.id,
+            Titles.title,
+            Titles.release_date,
+            Titles.overview,
+            Titles.genre_ids,
+            Titles.img_url,
+            Titles.movie_or_tv,
+            Titles.ratings,
+        ).order_by(Titles.id)
+        if since:
+            # Only titles reviewed since the given date, for incremental exports
+            query = query.where(
+                Titles.id.in_(
+                    db.select(Reviews.title_id).where(Reviews.date_posted >= since)
+                )
+            )
+    elif table == "reviews":
+        query = db.select(
+            Reviews.id,
+            Reviews.author_id,
+            Reviews.title_id,
+            Reviews.rating,
+            Reviews.comment,
+            Reviews.date_posted,
+        ).order_by(Reviews.id)
+        if since:
+            query = query.where(Reviews.date_posted >= since)
+    elif table == "ratings":
+        query = (
+            db.select(
+                Reviews.title_id,
+                db.func.count(Reviews.id).label("reviews_count"),
+                db.func.avg(Reviews.rating).label("average_rating"),
+                db.func.min(Reviews.rating).label("min_rating"),
+                db.func.max(Reviews.rating).label("max_rating"),
+                db.func.max(Reviews.date_posted).label("last_review"),
+            )
+            .group_by(Reviews.title_id)
+            .order_by(Reviews.title_id)
+        )
+        if since:
+            # Only titles reviewed since the given date, for incremental exports
+            query = query.where(
+                Reviews.title_id.in_(
+                    db.select(Reviews.title_id).where(Reviews.date_posted >= since)
+                )
+            )
+    return query
+
+
+# Generator yielding export file chunks, streaming rows from the database
+def export_chunks(table, export_format, since=None, compress=False):
+    # Stream the rows in batches with a server-side cursor
+    result = db.session.execute(
+        export_query(table, since).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == "csv":
+        writer.writerow(result.keys())
+
+    def flush_buffer():
+        # Take the buffered text as bytes, gzip compressed if requested
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    for row in result.mappings():
+        # Convert dates to ISO strings, which both formats can hold
+        row = {
+            key: value.isoformat() if isinstance(value, datetime.datetime) else value
+            for key, value in row.items()
+        }
+        if export_format == "csv":
+            writer.writerow(
+                json.dumps(value) if isinstance(value, list) else value
+                for value in row.values()
+            )
+        else:
+            buffer.write(json.dumps(row) + "\n")
+
+        # Yield in fixed size chunks, so memory stays flat
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield flush_buffer()
+
+    yield flush_buffer()
+    if compressor:
+        yield compressor.flush()
+
+
+# CLI command for exporting a table as CSV or JSON lines
+@app.cli.command("export")
+@click.argument("table", type=click.Choice(EXPORT_TABLES))
+@click.option(
+    "--format", "export_format", type=click.Choice(EXPORT_FORMATS), default="csv"
+)
+@click.option(
+    "--since", type=click.DateTime(), help="Only rows reviewed since this date."
+)
+@click.option("--gzip", "compress", is_flag=True, help="Gzip compress the output.")
+@click.option("--output", type=click.File("wb"), default="-", help="Output file.")
+def export(table, export_format, since, compress, output):
+    """Export titles, reviews or rating aggregates."""
+    for chunk in export_chunks(table, export_format, since, compress):
+        output.write(chunk)
+
+
+# Function to scale the rows of a matrix to unit length (zero rows stay zero)
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+# Function to compute the top-k similar titles for the given titles (all by default)
+def compute_similar_titles(target_ids=None, top_k=SIMILAR_TOP_K):
+    titles = db.session.execute(
+        db.select(Titles.id, Titles.genre_ids, Titles.ratings).order_by(Titles.id)
+    ).all()
+    if len(titles) < 2:
+        return {}
+    title_ids = np.array([title.id for title in titles])
+    title_index = {title_id: index for index, title_id in enumerate(title_ids)}
+
+    # Genre matrix: one row per title, one column per genre
+    genre_index = {}
+    genre_rows, genre_columns = [], []
+    for index, title in enumerate(titles):
+        for genre_id in title.genre_ids:
+            genre_rows.append(index)
+            genre_columns.append(genre_index.setdefault(genre_id, len(genre_index)))
+    genres = np.zeros((len(titles), len(genre_index)), dtype=np.float32)
+    genres[genre_rows, genre_columns] = 1
+    genres = normalize_rows(genres)
+
+    # Co-review matrix: one row per title, one column per reviewer
+    reviews = db.session.execute(
+        db.select(Reviews.title_id, Reviews.author_id).where(
+            Reviews.title_id.is_not(None), Reviews.author_id.is_not(None)
+        )
+    ).all()
+    author_index = {}
+    review_rows, review_columns = [], []
+    for review in reviews:
+        review_rows.append(title_index[review.title_id])
+        review_columns.append(
+            author_index.setdefault(review.author_id, len(author_index))
+        )
+    # Sparse, since each reviewer only reviewed a few of the titles
+    co_reviews = sparse.csr_matrix(
+        (np.ones(len(review_rows), dtype=np.float32), (review_rows, review_columns)),
+        shape=(len(titles), len(author_index)),
+    )
+    # Count a reviewer once per title, then scale the rows to unit length
+    co_reviews.sum_duplicates()
+    reviewers = np.diff(co_reviews.indptr)
+    co_reviews.data = np.repeat(
+        1 / np.sqrt(np.maximum(reviewers, 1)), reviewers
+    ).astype(np.float32)
+
+    # Average ratings, where 0 means the title was not rated yet
+    ratings = np.array([title.ratings or 0.0 for title in titles], dtype=np.float32)
+
+    if target_ids is None:
+        targets = np.arange(len(titles))
+    else:
+        targets = np.array(
+            [
+                title_index[title_id]
+                for title_id in target_ids
+                if title_id in title_index
+            ],
+            dtype=np.int64,
+        )
+    top_k = min(top_k, len(titles) - 1)
+
+    similar = {}
+    for start in range(0, len(targets), SIMILAR_BLOCK_SIZE):
+        block = targets[start : start + SIMILAR_BLOCK_SIZE]
+
+        # Cosine similarity of genres and co-reviews for the whole block at once
+        scores = SIMILAR_GENRE_WEIGHT * (genres[block] @ genres.T)
+        co_review_scores = (co_reviews[block] @ co_reviews.T).toarray()
+        scores += SIMILAR_CO_REVIEW_WEIGHT * co_review_scores
+
+        # Rating closeness, only where both titles are rated
+        rating_closeness = 1 - np.abs(ratings[block, None] - ratings[None, :]) / 10
+        both_rated = (ratings[block, None] > 0) & (ratings[None, :] > 0)
+        scores += SIMILAR_RATING_WEIGHT * np.where(both_rated, rating_closeness, 0)
+
+        # A title is not similar to itself
+        scores[np.arange(len(block)), block] = -np.inf
+
+        # Pick the top-k per row, then sort those by score
+        top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        for row, target in enumerate(block):
+            similar[int(title_ids[target])] = [
+                (int(title_ids[column]), float(score))
+                for column, score in zip(top[row], top_scores[row])
+                if score > 0
+            ]
+    return similar
+
+
+# CLI command for precomputing the "more like this" titles
+@app.cli.command("build-similar")
+@click.option("--full", is_flag=True, help="Recompute every title.")
+@click.option("--top-k", default=SIMILAR_TOP_K, help="Similar titles per title.")
+def build_similar(full, top_k):
+    """Precompute similar titles from genres, co-reviews and ratings."""
+    computed_at = datetime.datetime.now()
+    target_ids = None
+    if not full:
+        # Only titles without results yet, or reviewed since the last run
+        last_run = db.session.scalar(db.select(db.func.max(SimilarTitles.computed_at)))
+        query = db.select(Titles.id).where(
+            Titles.id.not_in(db.select(SimilarTitles.title_id))
+        )
+        if last_run:
+            query = query.union(
+                db.select(Reviews.title_id).where(Reviews.date_posted >= last_run)
+            )
+        target_ids = db.session.scalars(query).all()
+
+    similar = compute_similar_titles(target_ids, top_k)
+
+    # Replace the stored rows of the recomputed titles
+    title_ids = list(similar)
+    for start in range(0, len(title_ids), SIMILAR_BLOCK_SIZE):
+        batch = title_ids[start : start + SIMILAR_BLOCK_SIZE]
+        db.session.execute(
+            db.delete(SimilarTitles).where(SimilarTitles.title_id.in_(batch))
+        )
+        rows = [
+            {
+                "title_id": title_id,
+                "rank": rank,
+                "similar_id": similar_id,
+                "score": score,
+                "computed_at": computed_at,
+            }
+            for title_id in batch
+            for rank, (similar_id, score) in enumerate(similar[title_id])
+        ]
+        if rows:
+            db.session.execute(db.insert(SimilarTitles), rows)
+        db.session.commit()
+    click.echo(f"Computed similar titles for {len(title_ids)} titles")
+
+
+# CLI command for recomputing the trending scores from all reviews
+@app.cli.command("rebuild-trending")
+def rebuild_trending():
+    """Recompute the trending scores of all titles from their reviews."""
+    scores = {}
+    reviews = db.session.execute(
+        db.select(Reviews.title_id, Reviews.date_posted)
+        .where(Reviews.title_id.is_not(None))
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    for title_id, date_posted in reviews:
+        activity = trending_log_score(TRENDING_NEW_REVIEW_WEIGHT, date_posted)
+        scores[title_id] = float(np.logaddexp(scores.get(title_id, -np.inf), activity))
+
+    # Reset every title, then write the scores with one bulk UPDATE
+    db.session.execute(db.update(Titles).values(trending=None))
+    if scores:
+        db.session.execute(
+            db.update(Titles),
+            [{"id": title_id, "trending": score} for title_id, score in scores.items()],
+        )
+    db.session.commit()
+    click.echo(f"Rebuilt trending scores for {len(scores)} titles")
+
+
+# Profile a sampled fraction of requests, or admin requests with the X-Profile header
+@app.before_request
+def start_profiler():
+    # Cheap checks first, so the hook costs almost nothing when disabled
+    sampled = PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE
+    if not sampled and PROFILE_HEADER not in request.headers:
+        return
+    if not sampled and not (current_user.is_authenticated and current_user.id == 1):
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already running in this process
+        return
+    g.profiler = profiler
+    g.profile_started = time.perf_counter()
+
+
+# Stop the profiler and save the profile of the request
+@app.teardown_request
+def stop_profiler(exception):
+    profiler = g.pop("profiler", None)
+    if profiler:
+        profiler.disable()
+        duration_ms = (time.perf_counter() - g.profile_started) * 1000
+        save_profile(profiler, request.endpoint or "unknown", duration_ms)
+
+
+# Function to save a profile as pstats and as a text summary, per endpoint
+def save_profile(profiler, endpoint, duration_ms):
+    endpoint_dir = os.path.join(PROFILE_DIR, endpoint)
+    os.makedirs(endpoint_dir, exist_ok=True)
+    name = f"{datetime.datetime.now():%Y%m%d-%H%M%S-%f}-{duration_ms:.0f}ms"
+    profiler.dump_stats(os.path.join(endpoint_dir, f"{name}.pstats"))
+
+    # Write the top functions by cumulative time for reading in the browser
+    with open(os.path.join(endpoint_dir, f"{name}.txt"), "w") as summary_file:
+        stats = pstats.Stats(profiler, stream=summary_file)
+        stats.sort_stats("cumulative").print_stats(40)
+
+    # Keep only the newest profiles of the endpoint
+    names = sorted(
+        {os.path.splitext(file_name)[0] for file_name in os.listdir(endpoint_dir)}
+    )
+    for old_name in names[:-PROFILE_KEEP]:
+        for extension in (".pstats", ".txt"):
+            try:
+                os.remove(os.path.join(endpoint_dir, old_name + extension))
+            except FileNotFoundError:
+                pass
+
 
 # Context processor for injecting variables into templates
 @app.context_processor
@@ -203,6 +1673,300 @@ def inject_vars():
     return dict(current_user=current_user, year=datetime.datetime.now().year)
 
 
+# Rewrite url_for('static', ...) to the fingerprinted file name when available
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    if endpoint == "static" and values.get("filename") in static_manifest:
+        values["filename"] = static_manifest[values["filename"]]
+
+
+# CLI command for fingerprinting and precompressing the static files
+@app.cli.command("build-static")
+def build_static():
+    """Fingerprint and precompress static files into static/dist."""
+    # Start from an empty dist directory so stale hashed files are removed
+    shutil.rmtree(STATIC_DIST_DIR, ignore_errors=True)
+    manifest = {}
+
+    for static_dir in STATIC_BUILD_DIRS:
+        source_root = os.path.join(app.static_folder, static_dir)
+        for dir_path, _, file_names in os.walk(source_root):
+            for file_name in file_names:
+                source_path = os.path.join(dir_path, file_name)
+                with open(source_path, "rb") as source_file:
+                    content = source_file.read()
+
+                # Build the hashed file name, e.g. css/style.3f2a1b9c0d.css
+                relative_path = os.path.relpath(source_path, app.static_folder)
+                relative_path = relative_path.replace(os.sep, "/")
+                digest = hashlib.sha256(content).hexdigest()[:10]
+                stem, extension = os.path.splitext(relative_path)
+                hashed_path = f"{stem}.{digest}{extension}"
+
+                # Write the hashed file and its gzip/brotli variants
+                target_path = os.path.join(STATIC_DIST_DIR, hashed_path)
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                with open(target_path, "wb") as target_file:
+                    target_file.write(content)
+                if extension in STATIC_PRECOMPRESS_EXTENSIONS:
+                    with open(f"{target_path}.gz", "wb") as target_file:
+                        target_file.write(gzip.compress(content, compresslevel=9))
+                    with open(f"{target_path}.br", "wb") as target_file:
+                        target_file.write(brotli.compress(content, quality=11))
+
+                manifest[relative_path] = f"dist/{hashed_path}"
+
+    # Save the manifest used to rewrite static URLs
+    with open(STATIC_MANIFEST_PATH, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    click.echo(f"Built {len(manifest)} static files into {STATIC_DIST_DIR}")
+
+
+# Generator yielding the sitemap of the catalog pages, streaming the titles
+def sitemap_chunks():
+    def url_entry(endpoint, **values):
+        return f"<url><loc>{escape(url_for(endpoint, _external=True, **values))}</loc></url>\n"
+
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    yield url_entry("home")
+
+    # Every page of the movie and TV show listings
+    for movie_or_tv, movies_tv_shows in (("movie", "movies"), ("tv", "tv_shows")):
+        titles_number = db.session.scalar(
+            db.select(db.func.count(Titles.id)).where(Titles.movie_or_tv == movie_or_tv)
+        )
+        for page_number in range(1, ceil(titles_number / TITLES_PER_PAGE) + 1):
+            yield url_entry(
+                "movies_tv_pages",
+                movies_tv_shows=movies_tv_shows,
+                page_number=page_number,
+            )
+
+    # Every title page, in batches with a server-side cursor
+    titles = db.session.execute(
+        db.select(Titles.id, Titles.movie_or_tv)
+        .order_by(Titles.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    chunk = []
+    for title_id, movie_or_tv in titles:
+        chunk.append(url_entry("get_title", movie_or_tv=movie_or_tv, title_id=title_id))
+        if len(chunk) >= EXPORT_BATCH_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    yield "".join(chunk)
+    yield "</urlset>\n"
+
+
+# Function to write a pre-rendered page with its gzip/brotli variants
+def write_prerendered(url_path, content):
+    file_path = os.path.join(PRERENDER_DIR, prerendered_filename(url_path))
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    variants = {
+        file_path: content,
+        f"{file_path}.gz": gzip.compress(content, compresslevel=9),
+        f"{file_path}.br": brotli.compress(content, quality=11),
+    }
+
+    # Replace the files atomically, so visitors never get a partial page
+    for path, data in variants.items():
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+
+
+# Function to fingerprint the data shown on the title and listing pages
+def prerender_fingerprints():
+    # Number and latest date of the reviews of every title
+    review_stats = {
+        title_id: [count, latest]
+        for title_id, count, latest in db.session.execute(
+            db.select(
+                Reviews.title_id,
+                db.func.count(Reviews.id),
+                db.func.max(Reviews.date_posted),
+            ).group_by(Reviews.title_id)
+        )
+    }
+    # Time the "more like this" titles were last computed for every title
+    similar_stats = dict(
+        db.session.execute(
+            db.select(
+                SimilarTitles.title_id, db.func.max(SimilarTitles.computed_at)
+            ).group_by(SimilarTitles.title_id)
+        ).all()
+    )
+
+    # Hash every title, and the listing of each type in page order
+    titles = {}
+    listings = {"movie": hashlib.sha256(), "tv": hashlib.sha256()}
+    page_counts = {"movie": 0, "tv": 0}
+    result = db.session.execute(
+        db.select(
+            Titles.id,
+            Titles.movie_or_tv,
+            Titles.title,
+            Titles.release_date,
+            Titles.overview,
+            Titles.img_url,
+            Titles.genre_ids,
+            Titles.ratings,
+        )
+        .order_by(Titles.ratings.desc(), Titles.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    for row in result:
+        data = json.dumps(
+            [*row, review_stats.get(row.id), similar_stats.get(row.id)], default=str
+        ).encode()
+        titles[str(row.id)] = [row.movie_or_tv, hashlib.sha256(data).hexdigest()]
+        listings[row.movie_or_tv].update(data)
+        page_counts[row.movie_or_tv] += 1
+
+    listings = {
+        movie_or_tv: [
+            digest.hexdigest(),
+            ceil(page_counts[movie_or_tv] / TITLES_PER_PAGE),
+        ]
+        for movie_or_tv, digest in listings.items()
+    }
+    return titles, listings
+
+
+# Give each pre-render worker process its own database connections
+def init_prerender_worker():
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+# Function to render pages through the app and save them (runs in a worker)
+def prerender_pages(url_paths):
+    client = app.test_client()
+    failed = []
+    for url_path in url_paths:
+        # Render as an anonymous visitor, skipping the current pre-rendered file
+        response = client.get(url_path, environ_base={PRERENDER_ENVIRON_KEY: True})
+        if response.status_code != 200:
+            print(f"Error pre-rendering {url_path}: {response.status}")
+            failed.append(url_path)
+            continue
+        write_prerendered(url_path, response.get_data())
+    return failed
+
+
+# CLI command for pre-rendering the catalog pages for anonymous visitors
+@app.cli.command("prerender")
+@click.option("--full", is_flag=True, help="Render every page again.")
+@click.option("--workers", default=PRERENDER_WORKERS, help="Worker processes.")
+@click.option(
+    "--base-url", default="http://localhost/", help="Site URL used in the sitemap."
+)
+def prerender(full, workers, base_url):
+    """Pre-render the title and listing pages and the sitemap."""
+    manifest = {"titles": {}, "listings": {}}
+    if not full and os.path.isfile(PRERENDER_MANIFEST_PATH):
+        with open(PRERENDER_MANIFEST_PATH) as manifest_file:
+            manifest = json.load(manifest_file)
+    titles, listings = prerender_fingerprints()
+
+    # Only render the titles whose data changed since the last run
+    url_paths = [
+        f"/titles/{movie_or_tv}/{title_id}"
+        for title_id, (movie_or_tv, fingerprint) in titles.items()
+        if manifest["titles"].get(title_id) != [movie_or_tv, fingerprint]
+    ]
+    # Render every page of a listing when any title in it changed
+    for movie_or_tv, movies_tv_shows in (("movie", "movies"), ("tv", "tv_shows")):
+        fingerprint, page_count = listings[movie_or_tv]
+        old_fingerprint, old_page_count = manifest["listings"].get(
+            movie_or_tv, [None, 0]
+        )
+        if fingerprint != old_fingerprint:
+            url_paths.extend(
+                f"/{movies_tv_shows}/{page_number}"
+                for page_number in range(1, page_count + 1)
+            )
+
+        # Remove the pages past the new end of the listing
+        for page_number in range(page_count + 1, old_page_count + 1):
+            discard_prerendered(f"/{movies_tv_shows}/{page_number}")
+
+    # Remove the pages of deleted titles
+    for title_id, (movie_or_tv, _) in manifest["titles"].items():
+        if title_id not in titles:
+            discard_prerendered_title(movie_or_tv, title_id)
+
+    # Render the pages in parallel, in chunks per worker task
+    chunks = [
+        url_paths[start : start + PRERENDER_CHUNK_SIZE]
+        for start in range(0, len(url_paths), PRERENDER_CHUNK_SIZE)
+    ]
+    failed = set()
+    if chunks:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_prerender_worker
+        ) as executor:
+            for failed_paths in executor.map(prerender_pages, chunks):
+                failed.update(failed_paths)
+
+    # Stream the sitemap straight into its file
+    response = app.test_client().get(
+        "/sitemap.xml", base_url=base_url, environ_base={PRERENDER_ENVIRON_KEY: True}
+    )
+    write_prerendered("/sitemap.xml", b"".join(response.iter_encoded()))
+
+    # Save the fingerprints, leaving out failed pages so they are retried
+    for title_id, (movie_or_tv, _) in list(titles.items()):
+        if f"/titles/{movie_or_tv}/{title_id}" in failed:
+            del titles[title_id]
+    for movie_or_tv, movies_tv_shows in (("movie", "movies"), ("tv", "tv_shows")):
+        if any(path.startswith(f"/{movies_tv_shows}/") for path in failed):
+            listings[movie_or_tv][0] = None
+    with open(PRERENDER_MANIFEST_PATH, "w") as manifest_file:
+        json.dump({"titles": titles, "listings": listings}, manifest_file)
+    click.echo(
+        f"Pre-rendered {len(url_paths) - len(failed)} pages into {PRERENDER_DIR}"
+    )
+
+
+# Serve the pre-rendered version of catalog pages to anonymous visitors
+@app.before_request
+def serve_prerendered():
+    if (
+        request.method not in ("GET", "HEAD")
+        or request.endpoint not in PRERENDER_ENDPOINTS
+        or request.query_string
+        or request.environ.get(PRERENDER_ENVIRON_KEY)
+        or current_user.is_authenticated
+        or session.get("_flashes")
+    ):
+        return
+
+    filename = prerendered_filename(request.path)
+    file_path = safe_join(PRERENDER_DIR, filename)
+    if file_path and os.path.isfile(file_path):
+        return send_precompressed(PRERENDER_DIR, filename, max_age=0)
+
+
+# Decorator for sending the queries of GET requests to a read replica
+def read_only(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Users who just wrote something keep reading from the primary
+        if (
+            request.method in ("GET", "HEAD")
+            and session.get("primary_until", 0) < time.time()
+        ):
+            db.session.info["read_only"] = True
+
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
 # Decorator for restricting access to admin-only routes
 def admin_only(f):
     @wraps(f)
@@ -221,6 +1985,7 @@ def admin_only(f):
 
 # Route for the homepage
 @app.route("/")
+@read_only
 def home():
     # Query all titles from the database
     all_titles = db.session.query(Titles).all()
@@ -242,8 +2007,24 @@ def home():
         .all()
     )
 
-    # Create a dictionary with top movies and TV shows
-    top_titles = {"Movies": top_movies, "TV Shows": top_tvs}
+    # Get the 10 trending titles, whose decayed score is still high enough
+    trending_titles = (
+        db.session.query(Titles)
+        .filter(
+            Titles.trending
+            > trending_log_score(TRENDING_MIN_SCORE, datetime.datetime.now())
+        )
+        .order_by(Titles.trending.desc())
+        .limit(10)
+        .all()
+    )
+
+    # Create a dictionary with trending titles, top movies and TV shows
+    top_titles = {
+        "Trending Now": trending_titles,
+        "Top 10 Movies": top_movies,
+        "Top 10 TV Shows": top_tvs,
+    }
 
     # Render the homepage template with title information
     return render_template(
@@ -277,11 +2058,7 @@ def signup():
             user = Users(
                 name=name,
                 email=email,
-                password=generate_password_hash(
-                    password,
-                    method="pbkdf2:sha256",
-                    salt_length=16,
-                ),
+                password=hash_password(password),
             )
             db.session.add(user)
             db.session.commit()
@@ -316,11 +2093,16 @@ def login():
             # If the user does not exist, flash a warning and redirect to the login page
             flash("That email does not exist, please try again.", "warning")
             return redirect(url_for("login"))
-        elif not check_password_hash(user.password, password):
+        elif not verify_password(user.password, password):
             # If the password is incorrect, flash a warning and redirect to the login page
             flash("Password incorrect, please try again.", "warning")
             return redirect(url_for("login"))
         else:
+            # Rehash the password if the configured method or cost has changed
+            if password_needs_rehash(user.password):
+                user.password = hash_password(password)
+                db.session.commit()
+
             # If login is successful, log in the user and redirect to the homepage
             login_user(user)
             flash(f"Welcome {user.name}, you are now logged in.", "success")
@@ -361,44 +2143,49 @@ def add():
 # Route for selecting a title from search results (admin only)
 @app.route("/select", methods=["POST", "GET"])
 @admin_only
+@rate_limited(SELECT_RATE_LIMIT, SELECT_RATE_BURST)
 def select():
     # Retrieve title and movie_or_tv parameters from the request arguments
     title = request.args.get("title")
     movie_or_tv = request.args.get("movie_or_tv")
 
-    # Fetch titles from the TMDB API based on the provided parameters
-    titles_list = fetch_titles_from_api(movie_or_tv, title)
-
     if request.method == "POST":
-        # Retrieve the selected title ID from the form
-        title_id = int(request.form.get("action"))
-        selected_title = titles_list[title_id]
+        # Retrieve the selected TMDB type and ID from the form (e.g. "movie:603")
+        selected_type, _, selected_id = request.form.get("action", "").partition(":")
+        if selected_type not in ("movie", "tv") or not selected_id.isdigit():
+            abort(400)
 
         # Check if the selected title already exists in the database
-        if not db.session.get(Titles, selected_title.get("id")):
-            # If not, create a new Titles object and add it to the database
-            title_obj = Titles(
-                id=selected_title.get("id"),
-                title=selected_title.get("title"),
-                release_date=datetime.datetime.strptime(
-                    selected_title.get("release_date"), "%Y-%m-%d"
-                ),
-                overview=selected_title.get("overview"),
-                img_url=selected_title.get("img_url"),
-                genre_ids=selected_title.get("genre_ids"),
-                movie_or_tv=movie_or_tv,
-            )
-            db.session.add(title_obj)
-            db.session.commit()
-            flash("Title added successfully.", "success")
-            return redirect(url_for("home"))
-        else:
+        if db.session.get(Titles, int(selected_id)):
             # If the title already exists, flash a warning message
             flash("Title already exists in the database.", "warning")
+            return redirect(request.url)
+
+        # Load only the selected title, so the search order cannot change it
+        selected_title = fetch_title_from_api(selected_type, selected_id)
+        if not selected_title:
+            flash("Title was not found on TMDB.", "warning")
+            return redirect(request.url)
+
+        # Create a new Titles object and add it to the database
+        title_obj = Titles(
+            id=selected_title.get("id"),
+            title=selected_title.get("title"),
+            release_date=datetime.datetime.strptime(
+                selected_title.get("release_date"), "%Y-%m-%d"
+            ),
+            overview=selected_title.get("overview"),
+            img_url=selected_title.get("img_url"),
+            genre_ids=selected_title.get("genre_ids"),
+            movie_or_tv=selected_title.get("movie_or_tv"),
+        )
+        db.session.add(title_obj)
+        db.session.commit()
+        flash("Title added successfully.", "success")
+        return redirect(url_for("home"))
 
-    # Enumerate titles_list if it's not empty
-    if titles_list:
-        titles_list = enumerate(titles_list)
+    # Fetch titles from the TMDB API based on the provided parameters
+    titles_list = fetch_titles_from_api(movie_or_tv, title)
 
     # Render the title selection template with the fetched titles
     return render_template("select.html", titles_list=titles_list)
@@ -409,13 +2196,11 @@ def select():
 @admin_only
 def delete_title():
     # Retrieve the title ID to delete from the request arguments
-    title_id = request.args.get("id")
+    title_id = request.args.get("id", type=int)
 
-    # Get the title object to delete from the database
-    title_to_delete = db.session.get(Titles, title_id)
-
-    # Delete the title from the database and commit the changes
-    db.session.delete(title_to_delete)
+    # Delete the title and its reviews with set-based statements
+    if not delete_titles_by_id([title_id]):
+        abort(404)
     db.session.commit()
 
     # Flash a success message and redirect back to the previous page
@@ -423,6 +2208,22 @@ def delete_title():
     return redirect(request.referrer.rpartition("/")[0])
 
 
+# Route for deleting several titles at once (admin only)
+@app.route("/delete-titles/", methods=["POST"])
+@admin_only
+def delete_titles():
+    # Retrieve the selected title IDs from the form
+    title_ids = request.form.getlist("title_ids", type=int)
+
+    # Delete all the titles and their reviews in one transaction
+    deleted_count = delete_titles_by_id(title_ids) if title_ids else 0
+    db.session.commit()
+
+    # Flash a success message and redirect back to the previous page
+    flash(f"{deleted_count} titles were removed.", "success")
+    return redirect(request.referrer or url_for("home"))
+
+
 # Route for deleting a review (admin only)
 @app.route("/delete-review/")
 @admin_only
@@ -444,6 +2245,7 @@ def delete_review():
 
 # Route for displaying details of a title (movie or TV show)
 @app.route("/titles/<movie_or_tv>/<int:title_id>", methods=["POST", "GET"])
+@read_only
 def get_title(movie_or_tv, title_id):
     # Check if the provided movie_or_tv parameter is valid
     if movie_or_tv not in ("movie", "tv"):
@@ -501,6 +2303,14 @@ def get_title(movie_or_tv, title_id):
     # Create a list of reviewer IDs for displaying reviewer information
     reviewers_ids = [review.author.id for review in reviews]
 
+    # Retrieve the precomputed similar titles, ordered by rank
+    similar_titles = db.session.scalars(
+        db.select(Titles)
+        .join(SimilarTitles, SimilarTitles.similar_id == Titles.id)
+        .where(SimilarTitles.title_id == title_id)
+        .order_by(SimilarTitles.rank)
+    ).all()
+
     # Render the template with the title, reviews, and related information
     return render_template(
         "title_page.html",
@@ -508,6 +2318,57 @@ def get_title(movie_or_tv, title_id):
         reviews=reviews,
         genres_list=genres_list,
         reviewers_ids=reviewers_ids,
+        similar_titles=similar_titles,
+    )
+
+
+# Route for displaying the reviews of a user, newest first
+@app.route("/users/<int:user_id>/reviews")
+@read_only
+def user_reviews(user_id):
+    # Retrieve the user from the database based on the given user_id
+    user = db.session.get(Users, user_id)
+    if not user:
+        abort(404)
+
+    # Query the reviews with their titles in one query, using the author index
+    query = (
+        db.select(Reviews)
+        .join(Reviews.title)
+        .options(contains_eager(Reviews.title))
+        .where(Reviews.author_id == user_id)
+        .order_by(Reviews.date_posted.desc(), Reviews.id.desc())
+    )
+
+    # Continue after the last review of the previous page (keyset pagination)
+    before = request.args.get("before")
+    before_id = request.args.get("before_id", type=int)
+    if before and before_id:
+        try:
+            before = datetime.datetime.fromisoformat(before)
+        except ValueError:
+            abort(400)
+        query = query.where(
+            db.tuple_(Reviews.date_posted, Reviews.id) < (before, before_id)
+        )
+
+    # Fetch one extra review to know if there is a next page
+    reviews = db.session.scalars(query.limit(REVIEWS_PER_PAGE + 1)).all()
+    next_page = None
+    if len(reviews) > REVIEWS_PER_PAGE:
+        reviews = reviews[:REVIEWS_PER_PAGE]
+        next_page = {
+            "before": reviews[-1].date_posted.isoformat(),
+            "before_id": reviews[-1].id,
+        }
+
+    # Render the template with the user's reviews and the next page cursor
+    return render_template(
+        "user_reviews.html",
+        user=user,
+        reviews=reviews,
+        next_page=next_page,
+        first_page=not before_id,
     )
 
 
@@ -530,6 +2391,7 @@ def tv_shows():
 
 # Generic route for displaying a paginated list of movies or TV shows
 @app.route("/<movies_tv_shows>/<int:page_number>")
+@read_only
 def movies_tv_pages(movies_tv_shows, page_number):
     # Check if the provided movies_tv_shows parameter is valid
     if movies_tv_shows not in ("movies", "tv_shows"):
@@ -570,6 +2432,86 @@ def movies_tv_pages(movies_tv_shows, page_number):
         )
 
 
+# Route for listing the release years and decades with their title counts
+@app.route("/years/")
+@read_only
+def years():
+    # Read the counts from the small precomputed table
+    year_counts = db.session.execute(
+        db.select(YearCounts.year, db.func.sum(YearCounts.count))
+        .group_by(YearCounts.year)
+        .having(db.func.sum(YearCounts.count) > 0)
+        .order_by(YearCounts.year.desc())
+    ).all()
+
+    # Group the years by decade, newest first
+    decades = {}
+    for year, count in year_counts:
+        decades.setdefault(year // 10 * 10, []).append((year, count))
+
+    # Render the template with the years and decades
+    return render_template("years.html", decades=decades)
+
+
+# Route for displaying the titles released in a year, ordered by rating
+@app.route("/year/<int:year>/<int:page_number>")
+@read_only
+def year_pages(year, page_number):
+    return release_years_page(year, year, page_number, f"year/{year}")
+
+
+# Route for displaying the titles released in a decade, ordered by rating
+@app.route("/decade/<int:decade>/<int:page_number>")
+@read_only
+def decade_pages(decade, page_number):
+    # Check if the provided decade is valid (e.g. 1990)
+    if decade % 10:
+        abort(404)
+    return release_years_page(decade, decade + 9, page_number, f"decade/{decade}")
+
+
+# Function to render a paginated list of the titles released in a range of years
+def release_years_page(first_year, last_year, page_number, movies_tv_shows):
+    # Check if the years can be stored as dates, otherwise abort with 404
+    if first_year < datetime.MINYEAR or last_year > datetime.MAXYEAR - 1:
+        abort(404)
+
+    # Count the titles for pagination from the precomputed year counts
+    titles_number = db.session.scalar(
+        db.select(db.func.coalesce(db.func.sum(YearCounts.count), 0)).where(
+            YearCounts.year.between(first_year, last_year)
+        )
+    )
+    total_pages = int(ceil(titles_number / TITLES_PER_PAGE))
+
+    # Check if the requested page is valid (and the years have titles)
+    if page_number < 1 or page_number > total_pages:
+        abort(404)
+
+    # Query the titles of the years, using the (movie_or_tv, release_date) index
+    all_titles = (
+        db.session.query(Titles)
+        .filter(
+            Titles.movie_or_tv.in_(("movie", "tv")),
+            Titles.release_date >= datetime.datetime(first_year, 1, 1),
+            Titles.release_date < datetime.datetime(last_year + 1, 1, 1),
+        )
+        .order_by(Titles.ratings.desc())
+        .offset((page_number - 1) * TITLES_PER_PAGE)
+        .limit(TITLES_PER_PAGE)
+        .all()
+    )
+
+    # Render the template with the paginated titles and pagination information
+    return render_template(
+        "display_all.html",
+        all_titles=all_titles,
+        total_pages=total_pages,
+        page_number=page_number,
+        movies_tv_shows=movies_tv_shows,
+    )
+
+
 # Route for searching titles
 @app.route("/search/<search_input>")
 def search(search_input):
@@ -586,6 +2528,8 @@ def search(search_input):
 
 # Generic route for displaying paginated search results
 @app.route("/search/<search_input>/<int:page_number>")
+@rate_limited(SEARCH_RATE_LIMIT, SEARCH_RATE_BURST)
+@read_only
 def search_pages(search_input, page_number):
     # Query the database for paginated search results
     search_result = (
@@ -623,6 +2567,8 @@ def search_pages(search_input, page_number):
 
 # Route for searching titles and returning JSON
 @app.route("/search-result/")
+@rate_limited(SEARCH_RATE_LIMIT, SEARCH_RATE_BURST)
+@read_only
 def search_result():
     # Retrieve search input from the query parameters
     input_query = request.args.get("search-input")
@@ -632,7 +2578,7 @@ def search_result():
     search_info = {
         title.id: {
             "title": title.title,
-            "img_url": title.img_url,
+            "img_url": title.poster_url("small"),
             "movie_or_tv": title.movie_or_tv,
         }
         for title in search_result
@@ -640,5 +2586,189 @@ def search_result():
     return jsonify(search_info)
 
 
+# Route for streaming an export of a table (admin only)
+@app.route("/admin/export/<table>")
+@admin_only
+@read_only
+def export_table(table):
+    # Check if the table and format are valid
+    export_format = request.args.get("format", "csv")
+    if table not in EXPORT_TABLES or export_format not in EXPORT_FORMATS:
+        abort(404)
+
+    # Parse the optional date for incremental exports
+    since = request.args.get("since")
+    if since:
+        try:
+            since = datetime.datetime.fromisoformat(since)
+        except ValueError:
+            abort(400)
+    compress = request.args.get("gzip") == "1"
+
+    # Stream the export as a file download
+    filename = f"{table}.{export_format}" + (".gz" if compress else "")
+    response = Response(
+        stream_with_context(export_chunks(table, export_format, since, compress)),
+        mimetype="application/gzip" if compress else EXPORT_FORMATS[export_format],
+    )
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+
+# Route for listing the saved request profiles (admin only)
+@app.route("/admin/profiles/")
+@admin_only
+def profiles():
+    # Collect the profiles of every endpoint, newest first
+    profiles_by_endpoint = {}
+    if os.path.isdir(PROFILE_DIR):
+        for endpoint in sorted(os.listdir(PROFILE_DIR)):
+            endpoint_dir = os.path.join(PROFILE_DIR, endpoint)
+            names = sorted(
+                {os.path.splitext(name)[0] for name in os.listdir(endpoint_dir)},
+                reverse=True,
+            )
+            profiles_by_endpoint[endpoint] = names
+
+    # Render the template with the profiles
+    return render_template("profiles.html", profiles_by_endpoint=profiles_by_endpoint)
+
+
+# Route for viewing or downloading a saved request profile (admin only)
+@app.route("/admin/profiles/<endpoint_name>/<filename>")
+@admin_only
+def download_profile(endpoint_name, filename):
+    # Only serve files from the endpoint folders inside PROFILE_DIR
+    endpoint_dir = safe_join(PROFILE_DIR, endpoint_name)
+    if not endpoint_dir:
+        abort(404)
+
+    # Show text summaries in the browser and download pstats files
+    return send_from_directory(
+        endpoint_dir,
+        filename,
+        as_attachment=filename.endswith(".pstats"),
+    )
+
+
+# Route for exposing Prometheus metrics
+@app.route("/metrics")
+def metrics():
+    # Collect the metrics of all gunicorn workers in multiprocess mode
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+# Route for checking the connection pools and the databases are alive
+@app.route("/healthz")
+def healthz():
+    databases = {}
+    for bind_key, engine in db.engines.items():
+        database = bind_key or "primary"
+        try:
+            # Check out a connection and run a query that touches no tables
+            with engine.connect() as connection:
+                connection.exec_driver_sql("SELECT 1")
+            databases[database] = {"ok": True}
+        except Exception as e:
+            print(f"Error in health check of {database}: {e!r}")
+            databases[database] = {"ok": False}
+        databases[database]["pool"] = engine.pool.status()
+
+    # Report 503 so load balancers stop sending requests to this worker
+    healthy = all(database["ok"] for database in databases.values())
+    status_code = 200 if healthy else 503
+    return (
+        jsonify(status="ok" if healthy else "error", databases=databases),
+        status_code,
+    )
+
+
+# Route for serving locally cached, resized posters
+@app.route("/posters/<int:title_id>/<poster_hash>/<size>.jpg")
+def poster(title_id, poster_hash, size):
+    # Check if the requested size is a known variant
+    if size not in POSTER_SIZES:
+        abort(404)
+
+    path = poster_cache_path(title_id, poster_hash, size)
+    if os.path.isfile(path):
+        # Mark the poster as recently used for the eviction policy
+        os.utime(path)
+        poster_file = path
+    else:
+        # Check if the title exists and the hash matches its current poster
+        title = db.session.get(Titles, title_id)
+        if not title or title.poster_hash != poster_hash:
+            abort(404)
+
+        try:
+            # Fetch the poster once and store every variant
+            variants = cache_poster_variants(title)
+        except (requests.RequestException, OSError) as e:
+            print(f"Error while caching poster: {e}")
+            # Fall back to the original TMDB poster
+            return redirect(title.img_url)
+
+        # Serve the bytes this request encoded, not whatever is at path now
+        poster_file = io.BytesIO(variants[size])
+
+    # The URL changes whenever the poster does, so it can be cached forever
+    response = send_file(poster_file, mimetype="image/jpeg", max_age=STATIC_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+# Function to serve a file, or its best precompressed variant the client accepts
+def send_precompressed(directory, filename, max_age=None):
+    # Pick the best precompressed variant the client accepts
+    content_encoding = None
+    served_filename = filename
+    for encoding, extension in (("br", ".br"), ("gzip", ".gz")):
+        variant_path = safe_join(directory, filename + extension)
+        if (
+            request.accept_encodings[encoding]
+            and variant_path
+            and os.path.isfile(variant_path)
+        ):
+            content_encoding = encoding
+            served_filename = filename + extension
+            break
+
+    # Serve the file with the mimetype of the original, uncompressed name
+    response = send_from_directory(
+        directory,
+        served_filename,
+        mimetype=mimetypes.guess_type(filename)[0],
+        max_age=max_age,
+    )
+    response.headers.pop("Content-Disposition", None)
+    response.vary.add("Accept-Encoding")
+    if content_encoding:
+        response.headers["Content-Encoding"] = content_encoding
+    return response
+
+
+# Route for streaming the sitemap of the catalog pages
+@app.route("/sitemap.xml")
+@read_only
+def sitemap():
+    return Response(stream_with_context(sitemap_chunks()), mimetype="application/xml")
+
+
+# Route for serving fingerprinted static files with far-future cache headers
+@app.route("/static/dist/<path:filename>")
+def static_dist(filename):
+    response = send_precompressed(STATIC_DIST_DIR, filename, max_age=STATIC_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", debug=True)
@@ -0,0 +1,38 @@
+"""add review_count to users and index reviews by author and date
+
+Revision ID: 9d3e5a1c7b42
+Revises: 4b1f6c9e2a7d
+Create Date: 2026-10-19 12:48:10.527113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3e5a1c7b42'
+down_revision = '4b1f6c9e2a7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('review_count', sa.Integer(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.create_index('ix_reviews_author_id_date_posted', ['author_id', sa.text('date_posted DESC'), sa.text('id DESC')], unique=False)
+
+    # Backfill the denormalized review counts
+    op.execute(
+        "UPDATE users SET review_count = "
+        "(SELECT COUNT(*) FROM reviews WHERE reviews.author_id = users.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.drop_index('ix_reviews_author_id_date_posted')
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('review_count')
@@ -0,0 +1,46 @@
+"""add year_counts table and index titles by type and release date
+
+Revision ID: c6a2d84f1e93
+Revises: 9d3e5a1c7b42
+Create Date: 2026-10-19 13:36:52.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6a2d84f1e93'
+down_revision = '9d3e5a1c7b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    year_counts = op.create_table('year_counts',
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('movie_or_tv', sa.String(length=20), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('year', 'movie_or_tv')
+    )
+    with op.batch_alter_table('titles', schema=None) as batch_op:
+        batch_op.create_index('ix_titles_movie_or_tv_release_date', ['movie_or_tv', 'release_date'], unique=False)
+
+    # Backfill the counts from the existing titles
+    titles = sa.table('titles', sa.column('release_date', sa.DateTime()), sa.column('movie_or_tv', sa.String()))
+    release_year = sa.cast(sa.extract('year', titles.c.release_date), sa.Integer())
+    op.execute(
+        year_counts.insert().from_select(
+            ['year', 'movie_or_tv', 'count'],
+            sa.select(release_year, titles.c.movie_or_tv, sa.func.count()).group_by(
+                release_year, titles.c.movie_or_tv
+            ),
+        )
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('titles', schema=None) as batch_op:
+        batch_op.drop_index('ix_titles_movie_or_tv_release_date')
+
+    op.drop_table('year_counts')